@@ -11,7 +11,7 @@ import os
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from xml_processor import XMLCreditDataProcessor
+from xml_processor import XMLCreditDataProcessor, write_csv, write_parquet
 
 def main():
     """Run analysis from project root"""
@@ -29,16 +29,25 @@ def main():
     output_dir = "output"
     os.makedirs(output_dir, exist_ok=True)
     
+    # Cache parsed data so validation can skip a second XML pass
+    processor.save_cache(os.path.join(output_dir, ".proc_cache.pkl"))
+    
     # Save results to output directory
     metrics_df = processor.calculate_client_metrics()
     if not metrics_df.empty:
-        metrics_df.to_csv(os.path.join(output_dir, "client_metrics_results.csv"), index=False)
+        write_csv(metrics_df, os.path.join(output_dir, "client_metrics_results.csv"))
         print(f"✅ Results saved to {output_dir}/client_metrics_results.csv")
         
         # Also save detailed data
         if processor.results_df is not None and not processor.results_df.empty:
-            processor.results_df.to_csv(os.path.join(output_dir, "detailed_credit_data.csv"), index=False)
+            write_csv(processor.results_df, os.path.join(output_dir, "detailed_credit_data.csv"))
             print(f"✅ Detailed data saved to {output_dir}/detailed_credit_data.csv")
+            
+            # Columnar copy for faster downstream reads (requires pyarrow)
+            if write_parquet(processor.results_df, os.path.join(output_dir, "detailed_credit_data.parquet")):
+                print(f"✅ Detailed data saved to {output_dir}/detailed_credit_data.parquet")
+            else:
+                print("⚠️  pyarrow not installed, skipping Parquet export")
     
     # Print summary
     processor.print_summary()
@@ -4,10 +4,16 @@
 Final validation and report generation for Finhike Risk Analysis
 """
 
-from xml_processor import XMLCreditDataProcessor
+from xml_processor import XMLCreditDataProcessor, read_csv
 import pandas as pd
+import numpy as np
 import json
 
+try:
+    import orjson
+except ImportError:  # orjson not installed - use the standard library encoder
+    orjson = None
+
 def run_final_analysis():
     """Run final analysis with comprehensive reporting"""
     print("=== FINHIKE RISK ANALYSIS - FINAL RUN ===")
@@ -40,36 +46,51 @@ def generate_final_report(processor, metrics_df):
     """Generate comprehensive final report"""
     
     # Load detailed data
-    detailed_df = pd.read_csv("detailed_credit_data.csv")
+    detailed_df = read_csv(
+        "detailed_credit_data.csv",
+        usecols=['client_id', 'deal_id', 'period_year', 'period_month'],
+        dtype={'client_id': str, 'deal_id': str, 'period_year': 'float64', 'period_month': 'float64'}
+    )
+    
+    # Deals without history only have a placeholder row with no period
+    history_records = int(detailed_df['period_year'].notna().sum())
     
     report = {
         'analysis_summary': {
             'total_clients': len(processor.clients_data),
-            'total_deals': sum(len(client['deals']) for client in processor.clients_data),
-            'total_historical_records': len(detailed_df),
-            'unique_deals': detailed_df['deal_id'].nunique(),
+            'total_deals': int(processor.deal_counts.sum()),
+            'total_historical_records': history_records,
+            'unique_deals': int(detailed_df['deal_id'].nunique()),
             'analysis_date': '2026-02-11'
         },
         'client_metrics': metrics_df.to_dict('records'),
         'portfolio_summary': {
-            'average_loans_per_client': metrics_df['total_loans_count'].mean(),
-            'overall_closure_rate': metrics_df['closed_loans_ratio'].mean(),
-            'total_expired_debt': metrics_df['expired_30_plus_amount'].sum(),
-            'clients_with_expired_debt': (metrics_df['expired_30_plus_amount'] > 0).sum()
+            'average_loans_per_client': float(metrics_df['total_loans_count'].mean()),
+            'overall_closure_rate': float(metrics_df['closed_loans_ratio'].mean()),
+            'total_expired_debt': float(metrics_df['expired_30_plus_amount'].sum()),
+            'clients_with_expired_debt': int((metrics_df['expired_30_plus_amount'] > 0).sum())
         },
         'data_quality': {
-            'records_processed': len(detailed_df),
-            'unique_clients': detailed_df['client_id'].nunique(),
+            'records_processed': history_records,
+            'unique_clients': int(detailed_df['client_id'].nunique()),
             'date_range': {
-                'earliest_period': f"{detailed_df['period_year'].min()}-{detailed_df['period_month'].min():02d}",
-                'latest_period': f"{detailed_df['period_year'].max()}-{detailed_df['period_month'].max():02d}"
+                'earliest_period': f"{int(detailed_df['period_year'].min())}-{int(detailed_df['period_month'].min()):02d}",
+                'latest_period': f"{int(detailed_df['period_year'].max())}-{int(detailed_df['period_month'].max()):02d}"
             }
         }
     }
     
     # Save comprehensive report
-    with open('final_analysis_report.json', 'w', encoding='utf-8') as f:
-        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    if orjson is not None:
+        with open('final_analysis_report.json', 'wb') as f:
+            f.write(orjson.dumps(
+                report,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+                default=str
+            ))
+    else:
+        with open('final_analysis_report.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
     
     print("✅ Final report saved to: final_analysis_report.json")
     
@@ -80,13 +101,16 @@ def generate_final_report(processor, metrics_df):
     print(f"🚨 Total risk exposure (30+ days): {report['portfolio_summary']['total_expired_debt']:,.2f} UAH")
     print(f"⚠️  High-risk clients: {report['portfolio_summary']['clients_with_expired_debt']}/{report['analysis_summary']['total_clients']}")
     
-    # Top risk clients
-    top_risk = metrics_df.nlargest(3, 'expired_30_plus_amount')
-    if not top_risk[top_risk['expired_30_plus_amount'] > 0].empty:
+    # Top risk clients - stable sort of the expired column instead of sorting the frame,
+    # so ties keep the earliest clients
+    expired = metrics_df['expired_30_plus_amount'].to_numpy()
+    top_risk = metrics_df.iloc[np.argsort(-expired, kind='stable')[:3]]
+    top_risk = top_risk[top_risk['expired_30_plus_amount'] > 0]
+    if not top_risk.empty:
         print("\n📋 Top risk clients:")
-        for _, row in top_risk[top_risk['expired_30_plus_amount'] > 0].iterrows():
-            risk_ratio = row['expired_30_plus_amount'] / report['portfolio_summary']['total_expired_debt'] * 100
-            print(f"   • Client {row['client_id']}: {row['expired_30_plus_amount']:,.2f} UAH ({risk_ratio:.1f}% of total risk)")
+        for row in top_risk.itertuples(index=False):
+            risk_ratio = row.expired_30_plus_amount / report['portfolio_summary']['total_expired_debt'] * 100
+            print(f"   • Client {row.client_id}: {row.expired_30_plus_amount:,.2f} UAH ({risk_ratio:.1f}% of total risk)")
 
 if __name__ == "__main__":
     import os
@@ -6,25 +6,96 @@ Objective: Validate the correctness of XML processing and metric calculations
 """
 
 import pandas as pd
-import xml.etree.ElementTree as ET
+import numpy as np
 import os
-import glob
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple
-from xml_processor import XMLCreditDataProcessor
+from xml_processor import XMLCreditDataProcessor, parse_deals, read_csv
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow not installed - validators read the CSV outputs only
+    pq = None
+
+# Detailed data columns used by the validation checks
+DETAILED_COLUMNS = [
+    'client_id', 'deal_id', 'period_year', 'period_month', 'transaction_amount',
+    'start_date', 'planned_end_date', 'actual_end_date', 'deal_status',
+    'current_debt', 'overdue_debt', 'days_overdue'
+]
+
+# Explicit types for the detailed data CSV - skips inference and keeps ids as strings
+DETAILED_DTYPES = {
+    'client_id': str,
+    'deal_id': str,
+    'start_date': str,
+    'planned_end_date': str,
+    'actual_end_date': str,
+    'transaction_amount': 'float64',
+    'current_debt': 'float64',
+    'overdue_debt': 'float64',
+    # Empty for deals without history records
+    'period_year': 'float64',
+    'period_month': 'float64',
+    'deal_status': 'float64',
+    'days_overdue': 'float64'
+}
+
+def _manual_client_metrics(xml_file: str) -> Dict:
+    """Calculate one client's metrics directly from its XML file"""
+    total_loans = 0
+    expired_30_plus = 0
+    
+    for deal in parse_deals(xml_file):
+        total_loans += 1
+        
+        # Find latest deallife for this deal in a single pass, comparing year/month
+        # packed into one int (months fit in 4 bits)
+        latest_key = -1
+        latest_history = None
+        for history in deal.iter('deallife'):
+            attrs = history.attrib
+            key = (int(attrs.get('dlyear') or 0) << 4) | int(attrs.get('dlmonth') or 0)
+            if key > latest_key:
+                latest_key = key
+                latest_history = history
+        
+        if latest_history is not None:
+            attrs = latest_history.attrib
+            days_overdue = int(attrs.get('dldayexp') or 0)
+            overdue_debt = float(attrs.get('dlamtexp') or 0)
+            
+            if days_overdue > 30:
+                expired_30_plus += overdue_debt
+    
+    return {
+        'total_loans': total_loans,
+        'expired_30_plus': expired_30_plus
+    }
 
 class ResultsValidator:
     """Validate XML processing results and calculated metrics"""
     
-    def __init__(self, data_folder: str = "Data"):
+    def __init__(self, data_folder: str = "Data", processor: XMLCreditDataProcessor = None):
         self.data_folder = data_folder
+        self.processor = processor
         self.validation_results = {}
         self.errors = []
         self.warnings = []
+        self.detailed_df = None
+        self.metrics_df = None
+        self._results_loaded = False
+        self._xml_files = None
         
     def validate_all(self) -> Dict:
         """Run all validation checks"""
         print("=== STARTING VALIDATION ===")
         
+        # Load result files and list XML inputs once, shared across all checks
+        self.load_results()
+        self._xml_files = None
+        self._get_xml_files()
+        
         # 1. Validate XML file processing
         self.validate_xml_processing()
         
@@ -45,18 +116,75 @@ class ResultsValidator:
         
         return self.validation_results
     
+    def load_results(self):
+        """Load the metrics and detailed data files produced by the processor"""
+        self.detailed_df = None
+        self.metrics_df = None
+        
+        # Prefer the Parquet copy when it is at least as fresh as the CSV
+        parquet_file = "detailed_credit_data.parquet"
+        if pq is not None and os.path.exists(parquet_file) and (
+                not os.path.exists("detailed_credit_data.csv") or
+                os.path.getmtime(parquet_file) >= os.path.getmtime("detailed_credit_data.csv")):
+            available = set(pq.read_schema(parquet_file).names)
+            self.detailed_df = pd.read_parquet(
+                parquet_file,
+                engine='pyarrow',
+                columns=[col for col in DETAILED_COLUMNS if col in available]
+            )
+            # Parquet keeps empty end dates as '' - read them as missing like the CSV does,
+            # so the source format cannot change which end date counts as the latest
+            if 'actual_end_date' in self.detailed_df:
+                self.detailed_df['actual_end_date'] = self.detailed_df['actual_end_date'].replace('', np.nan)
+        elif os.path.exists("detailed_credit_data.csv"):
+            # Project to the checked columns so unused ones are never parsed or held in memory
+            available = set(pd.read_csv("detailed_credit_data.csv", nrows=0).columns)
+            self.detailed_df = read_csv(
+                "detailed_credit_data.csv",
+                usecols=[col for col in DETAILED_COLUMNS if col in available],
+                dtype=DETAILED_DTYPES
+            )
+        
+        if os.path.exists("client_metrics_results.csv"):
+            self.metrics_df = read_csv("client_metrics_results.csv", dtype={'client_id': str})
+        
+        self._results_loaded = True
+    
+    def _ensure_results(self):
+        """Load result files on first use so each check can also run on its own"""
+        if not self._results_loaded:
+            self.load_results()
+    
+    def _get_xml_files(self) -> List[str]:
+        """List XML input files once per validation run, sorted for stable ordering"""
+        if self._xml_files is None:
+            if os.path.isdir(self.data_folder):
+                self._xml_files = sorted(
+                    entry.path for entry in os.scandir(self.data_folder)
+                    if entry.name.endswith('.xml') and not entry.name.startswith('.') and entry.is_file()
+                )
+            else:
+                self._xml_files = []
+        return self._xml_files
+    
     def validate_xml_processing(self):
         """Validate that XML files are processed correctly"""
         print("1. Validating XML processing...")
         
-        xml_files = glob.glob(os.path.join(self.data_folder, "*.xml"))
+        xml_files = self._get_xml_files()
         
         if not xml_files:
             self.errors.append("No XML files found for validation")
             return
         
-        processor = XMLCreditDataProcessor(self.data_folder)
-        processor.process_all_xml_files()
+        # Reuse already parsed data when available instead of parsing every file again
+        processor = self.processor
+        if processor is None:
+            processor = XMLCreditDataProcessor(self.data_folder)
+            if processor.load_cache():
+                print("Using cached XML processing results")
+            else:
+                processor.process_all_xml_files()
         
         # Check that all XML files were processed
         processed_clients = len(processor.clients_data)
@@ -68,14 +196,12 @@ class ResultsValidator:
             print(f"✅ All {processed_clients} XML files processed successfully")
         
         # Validate each client has deals
-        clients_without_deals = []
-        total_deals = 0
-        
-        for client in processor.clients_data:
-            if not client['deals']:
-                clients_without_deals.append(client['client_id'])
-            else:
-                total_deals += len(client['deals'])
+        clients_without_deals = [
+            client['client_id']
+            for client, deal_count in zip(processor.clients_data, processor.deal_counts)
+            if deal_count == 0
+        ]
+        total_deals = int(processor.deal_counts.sum())
         
         if clients_without_deals:
             self.warnings.append(f"Clients without deals: {clients_without_deals}")
@@ -93,11 +219,12 @@ class ResultsValidator:
         """Validate tabular data transformation"""
         print("\n2. Validating data transformation...")
         
-        if not os.path.exists("detailed_credit_data.csv"):
+        self._ensure_results()
+        if self.detailed_df is None:
             self.errors.append("Detailed credit data CSV not found")
             return
         
-        df = pd.read_csv("detailed_credit_data.csv")
+        df = self.detailed_df
         
         # Check required columns
         required_columns = [
@@ -140,64 +267,77 @@ class ResultsValidator:
         """Validate calculated metrics"""
         print("\n3. Validating metric calculations...")
         
-        if not os.path.exists("client_metrics_results.csv"):
+        self._ensure_results()
+        if self.metrics_df is None:
             self.errors.append("Client metrics CSV not found")
             return
         
-        metrics_df = pd.read_csv("client_metrics_results.csv")
-        detailed_df = pd.read_csv("detailed_credit_data.csv")
+        if self.detailed_df is None:
+            self.errors.append("Detailed credit data CSV not found")
+            return
         
-        # Validate each client's metrics
+        metrics_df = self.metrics_df
+        detailed_df = self.detailed_df
+        
+        # Latest state of every deal, computed once for all clients
+        latest_data = detailed_df.groupby(['client_id', 'deal_id'], observed=True).agg({
+            'actual_end_date': 'last',
+            'deal_status': 'last',
+            'overdue_debt': 'last',
+            'days_overdue': 'last'
+        }).reset_index()
+        
+        # Use same logic as main processor: status > 1 OR actual_end_date filled
+        closed = ((latest_data['deal_status'] > 1) | 
+                  ((latest_data['actual_end_date'].notna()) & 
+                   (latest_data['actual_end_date'] != '') & 
+                   (latest_data['actual_end_date'] != 'nan')))
+        expired = latest_data['overdue_debt'].where(
+            (latest_data['days_overdue'] > 30) & (latest_data['overdue_debt'].notna()), 0
+        )
+        
+        expected = latest_data.assign(closed=closed, expired=expired).groupby('client_id', observed=True).agg(
+            unique_deals=('deal_id', 'size'),
+            closed_count=('closed', 'sum'),
+            expired_30_plus=('expired', 'sum')
+        ).reindex(metrics_df['client_id']).fillna(0)
+        
+        unique_deals = expected['unique_deals'].to_numpy()
+        closed_count = expected['closed_count'].to_numpy()
+        expired_30_plus = expected['expired_30_plus'].to_numpy()
+        expected_ratio = np.divide(closed_count, unique_deals,
+                                   out=np.zeros(len(expected)), where=unique_deals > 0)
+        
+        # Compare whole columns at once
+        total_bad = unique_deals != metrics_df['total_loans_count'].to_numpy()
+        closed_bad = closed_count != metrics_df['closed_loans_count'].to_numpy()
+        ratio_bad = ~np.isclose(expected_ratio, metrics_df['closed_loans_ratio'].to_numpy(),
+                                rtol=0, atol=0.0001)
+        expired_bad = ~np.isclose(expired_30_plus, metrics_df['expired_30_plus_amount'].to_numpy(),
+                                  rtol=0, atol=0.01)
+        
+        # Report mismatches only
         validation_errors = []
         
-        for _, row in metrics_df.iterrows():
+        for i in np.flatnonzero(total_bad | closed_bad | ratio_bad | expired_bad):
+            row = metrics_df.iloc[i]
             client_id = row['client_id']
-            client_data = detailed_df[detailed_df['client_id'] == client_id]
             
-            # 1. Validate total loans count
-            unique_deals = client_data['deal_id'].nunique()
-            if unique_deals != row['total_loans_count']:
+            if total_bad[i]:
                 validation_errors.append(
-                    f"Client {client_id}: Expected {unique_deals} loans, got {row['total_loans_count']}"
+                    f"Client {client_id}: Expected {unique_deals[i]:.0f} loans, got {row['total_loans_count']}"
                 )
-            
-            # 2. Validate closed loans count
-            # Use same logic as main processor: status > 1 OR actual_end_date filled
-            latest_data = client_data.groupby('deal_id').agg({
-                'actual_end_date': 'last',
-                'deal_status': 'last'
-            }).reset_index()
-            
-            closed_count = ((latest_data['deal_status'] > 1) | 
-                           ((latest_data['actual_end_date'].notna()) & 
-                            (latest_data['actual_end_date'] != '') & 
-                            (latest_data['actual_end_date'] != 'nan'))).sum()
-            if closed_count != row['closed_loans_count']:
+            if closed_bad[i]:
                 validation_errors.append(
-                    f"Client {client_id}: Expected {closed_count} closed loans, got {row['closed_loans_count']}"
+                    f"Client {client_id}: Expected {closed_count[i]:.0f} closed loans, got {row['closed_loans_count']}"
                 )
-            
-            # 3. Validate closed loans ratio
-            expected_ratio = closed_count / unique_deals if unique_deals > 0 else 0
-            if abs(expected_ratio - row['closed_loans_ratio']) > 0.0001:
+            if ratio_bad[i]:
                 validation_errors.append(
-                    f"Client {client_id}: Expected ratio {expected_ratio:.4f}, got {row['closed_loans_ratio']}"
+                    f"Client {client_id}: Expected ratio {expected_ratio[i]:.4f}, got {row['closed_loans_ratio']}"
                 )
-            
-            # 4. Validate expired 30+ amount
-            latest_overdue = client_data.groupby('deal_id').agg({
-                'overdue_debt': 'last',
-                'days_overdue': 'last'
-            }).reset_index()
-            
-            expired_30_plus = latest_overdue[
-                (latest_overdue['days_overdue'] > 30) & 
-                (latest_overdue['overdue_debt'].notna())
-            ]['overdue_debt'].sum()
-            
-            if abs(expired_30_plus - row['expired_30_plus_amount']) > 0.01:
+            if expired_bad[i]:
                 validation_errors.append(
-                    f"Client {client_id}: Expected expired amount {expired_30_plus:.2f}, got {row['expired_30_plus_amount']}"
+                    f"Client {client_id}: Expected expired amount {expired_30_plus[i]:.2f}, got {row['expired_30_plus_amount']}"
                 )
         
         if validation_errors:
@@ -214,7 +354,12 @@ class ResultsValidator:
         """Validate data quality and consistency"""
         print("\n4. Validating data quality...")
         
-        detailed_df = pd.read_csv("detailed_credit_data.csv")
+        self._ensure_results()
+        if self.detailed_df is None:
+            self.errors.append("Detailed credit data CSV not found")
+            return
+        
+        detailed_df = self.detailed_df
         
         quality_issues = []
         
@@ -228,16 +373,10 @@ class ResultsValidator:
         
         # Check date consistency
         if 'start_date' in detailed_df.columns and 'planned_end_date' in detailed_df.columns:
-            date_issues = 0
-            for _, row in detailed_df.iterrows():
-                if pd.notna(row['start_date']) and pd.notna(row['planned_end_date']):
-                    try:
-                        start = pd.to_datetime(row['start_date'])
-                        end = pd.to_datetime(row['planned_end_date'])
-                        if start >= end:
-                            date_issues += 1
-                    except:
-                        pass
+            # Infer the format of each value separately; unparseable dates become NaT and are skipped
+            start = pd.to_datetime(detailed_df['start_date'], format='mixed', errors='coerce', cache=True)
+            end = pd.to_datetime(detailed_df['planned_end_date'], format='mixed', errors='coerce', cache=True)
+            date_issues = int(((start >= end) & start.notna() & end.notna()).sum())
             
             if date_issues > 0:
                 quality_issues.append(f"Date consistency issues: {date_issues} records")
@@ -258,7 +397,8 @@ class ResultsValidator:
         
         self.validation_results['data_quality'] = {
             'quality_issues': len(quality_issues),
-            'total_records_checked': len(detailed_df)
+            # Placeholder rows of deals without history carry no period and are not records
+            'total_records_checked': int(detailed_df['period_year'].notna().sum())
         }
     
     def cross_validate_metrics(self):
@@ -268,33 +408,51 @@ class ResultsValidator:
         # Manual calculation using direct XML parsing
         manual_metrics = self._manual_metric_calculation()
         
-        if not os.path.exists("client_metrics_results.csv"):
+        self._ensure_results()
+        if self.metrics_df is None:
             self.errors.append("Cannot cross-validate: metrics file missing")
             return
         
-        calculated_metrics = pd.read_csv("client_metrics_results.csv")
+        calculated_metrics = self.metrics_df
         
         cross_validation_errors = []
         
-        for client_id in manual_metrics:
-            # Convert client_id to string to match CSV format
-            calc_row = calculated_metrics[calculated_metrics['client_id'] == str(client_id)]
-            if calc_row.empty:
+        # Index calculated metrics by client_id once instead of filtering per client
+        calc_index = {str(cid): i for i, cid in enumerate(calculated_metrics['client_id'].to_numpy())}
+        calc_total_loans = calculated_metrics['total_loans_count'].to_numpy()
+        calc_expired = calculated_metrics['expired_30_plus_amount'].to_numpy()
+        
+        # Align manual results with calculated rows (client_id as string to match CSV format)
+        client_ids = list(manual_metrics)
+        positions = np.array([calc_index.get(str(cid), -1) for cid in client_ids], dtype=np.int64)
+        found = positions >= 0
+        manual_total = np.array([manual_metrics[cid]['total_loans'] for cid in client_ids], dtype=np.int64)
+        manual_expired = np.array([manual_metrics[cid]['expired_30_plus'] for cid in client_ids], dtype=float)
+        
+        # Compare each metric over all clients at once
+        total_bad = np.zeros(len(client_ids), dtype=bool)
+        expired_bad = np.zeros(len(client_ids), dtype=bool)
+        total_bad[found] = calc_total_loans[positions[found]] != manual_total[found]
+        expired_bad[found] = ~np.isclose(calc_expired[positions[found]], manual_expired[found],
+                                         rtol=0, atol=0.01)
+        
+        for j in np.flatnonzero(~found | total_bad | expired_bad):
+            client_id = client_ids[j]
+            manual = manual_metrics[client_id]
+            i = positions[j]
+            
+            if not found[j]:
                 cross_validation_errors.append(f"Client {client_id} missing from calculated metrics")
                 continue
             
-            calc_row = calc_row.iloc[0]
-            manual = manual_metrics[client_id]
-            
-            # Compare each metric
-            if calc_row['total_loans_count'] != manual['total_loans']:
+            if total_bad[j]:
                 cross_validation_errors.append(
-                    f"Client {client_id} total loans mismatch: calc={calc_row['total_loans_count']}, manual={manual['total_loans']}"
+                    f"Client {client_id} total loans mismatch: calc={calc_total_loans[i]}, manual={manual['total_loans']}"
                 )
             
-            if abs(calc_row['expired_30_plus_amount'] - manual['expired_30_plus']) > 0.01:
+            if expired_bad[j]:
                 cross_validation_errors.append(
-                    f"Client {client_id} expired amount mismatch: calc={calc_row['expired_30_plus_amount']}, manual={manual['expired_30_plus']}"
+                    f"Client {client_id} expired amount mismatch: calc={calc_expired[i]}, manual={manual['expired_30_plus']}"
                 )
         
         if cross_validation_errors:
@@ -311,39 +469,18 @@ class ResultsValidator:
         """Manually calculate metrics for cross-validation"""
         manual_results = {}
         
-        xml_files = glob.glob(os.path.join(self.data_folder, "*.xml"))
+        xml_files = self._get_xml_files()
+        
+        # Files are independent; lxml releases the GIL while parsing so threads scale
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [(xml_file, executor.submit(_manual_client_metrics, xml_file))
+                       for xml_file in xml_files]
         
-        for xml_file in xml_files:
+        for xml_file, future in futures:
             client_id = os.path.splitext(os.path.basename(xml_file))[0]
             
             try:
-                tree = ET.parse(xml_file)
-                root = tree.getroot()
-                
-                deals = root.findall('.//crdeal')
-                total_loans = len(deals)
-                
-                expired_30_plus = 0
-                
-                for deal in deals:
-                    # Get latest deallife for this deal
-                    deal_histories = deal.findall('.//deallife')
-                    if deal_histories:
-                        # Find latest history by year/month
-                        latest_history = max(deal_histories, 
-                                           key=lambda x: (int(x.get('dlyear', '0')), int(x.get('dlmonth', '0'))))
-                        
-                        days_overdue = int(latest_history.get('dldayexp', '0'))
-                        overdue_debt = float(latest_history.get('dlamtexp', '0') or '0')
-                        
-                        if days_overdue > 30:
-                            expired_30_plus += overdue_debt
-                
-                manual_results[client_id] = {
-                    'total_loans': total_loans,
-                    'expired_30_plus': expired_30_plus
-                }
-                
+                manual_results[client_id] = future.result()
             except Exception as e:
                 self.warnings.append(f"Error in manual calculation for {client_id}: {e}")
         
@@ -403,7 +540,7 @@ class ResultsValidator:
                 return False
         
         # Check if metrics make sense
-        metrics_df = pd.read_csv("client_metrics_results.csv")
+        metrics_df = read_csv("client_metrics_results.csv", dtype={'client_id': str})
         
         # Basic sanity checks
         if (metrics_df['closed_loans_ratio'] > 1).any():
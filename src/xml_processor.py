@@ -7,10 +7,167 @@ Objective: Transform XML credit data into tabular format and calculate client me
 
 import xml.etree.ElementTree as ET
 import pandas as pd
+import numpy as np
 import os
+import hashlib
+import pickle
 from datetime import datetime
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
 import glob
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from lxml import etree as LET
+except ImportError:  # lxml not installed - fall back to the standard library parser
+    LET = None
+
+# Exceptions raised by the active parser on malformed XML
+XMLParseError = (ET.ParseError, LET.XMLSyntaxError) if LET is not None else (ET.ParseError,)
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# Deal attributes extracted from each crdeal element, in tabular column order
+DEAL_FIELDS = (
+    'dlref',      # Transaction ID
+    'dlamt',      # Transaction amount (initial)
+    'dlcelcred',  # Transaction type
+    'dlcurr',     # Transaction currency
+    'dlvidobes',  # Type of collateral
+    'dlrolesub',  # Subject's role
+    'dlamtobes'   # Collateral value in base currency
+)
+
+# History attributes extracted from each deallife element, in tabular column order
+HISTORY_FIELDS = (
+    'dlmonth',    # Data period (month)
+    'dlyear',     # Data period (year)
+    'dlds',       # Transaction commencement date
+    'dldpf',      # Transaction closing date under contract
+    'dldff',      # Actual transaction end date
+    'dlflstat',   # Transaction status in current period
+    'dlamtlim',   # Current transaction limit
+    'dlamtpaym',  # Planned compulsory payment amount
+    'dlamtcur',   # Current debt amount
+    'dlamtexp',   # Current debt overdue amount
+    'dldayexp',   # Current number of days overdue
+    'dlflpay',    # Indication of payment made
+    'dlflbrk',    # Indication of arrears present
+    'dldateclc'   # Calculation date
+)
+EMPTY_HISTORY = (None,) * len(HISTORY_FIELDS)
+
+# Columns of the tabular output: client fields, then DEAL_FIELDS, then HISTORY_FIELDS
+TABULAR_COLUMNS = (
+    'client_id', 'client_file', 'deal_id', 'transaction_amount', 'transaction_type',
+    'currency', 'collateral_type', 'subject_role', 'collateral_value',
+    'period_month', 'period_year', 'start_date', 'planned_end_date', 'actual_end_date',
+    'deal_status', 'current_limit', 'planned_payment', 'current_debt', 'overdue_debt',
+    'days_overdue', 'payment_made', 'arrears_present', 'calculation_date'
+)
+
+# Numeric columns of the tabular output
+FLOAT_COLUMNS = (
+    'transaction_amount', 'collateral_value', 'current_limit', 'planned_payment',
+    'current_debt', 'overdue_debt'
+)
+INT_COLUMNS = (
+    'period_month', 'period_year', 'deal_status', 'days_overdue', 'payment_made', 'arrears_present'
+)
+
+# Low-cardinality text columns repeated on every history row, stored as categoricals
+CATEGORICAL_COLUMNS = (
+    'client_id', 'client_file', 'deal_id', 'transaction_type', 'currency',
+    'collateral_type', 'subject_role'
+)
+
+# Default location of the pickled clients_data cache written by run_analysis
+PROCESSOR_CACHE_FILE = os.path.join("output", ".proc_cache.pkl")
+CACHE_FORMAT = 4  # bump when the layout of the cached clients_data changes
+
+
+def xml_folder_signature(data_folder: str) -> str:
+    """Cheap fingerprint of the XML inputs based on file names, sizes and mtimes"""
+    digest = hashlib.sha1()
+    for xml_file in sorted(glob.glob(os.path.join(data_folder, "*.xml"))):
+        stat = os.stat(xml_file)
+        digest.update(f"{os.path.basename(xml_file)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def write_csv(df: pd.DataFrame, path: str):
+    """Write a DataFrame to CSV, using pyarrow's multithreaded writer when available"""
+    if pa is not None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        # pyarrow quotes empty strings; write them as null (an empty field) like to_csv does
+        for i, field in enumerate(table.schema):
+            value_type = field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+            if pa.types.is_string(value_type) or pa.types.is_large_string(value_type):
+                column = table.column(i).cast(value_type)
+                table = table.set_column(i, field.name, pc.if_else(pc.equal(column, ''), None, column))
+        pacsv.write_csv(table, path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_csv(path: str, usecols: List[str] = None, dtype: Dict = None) -> pd.DataFrame:
+    """
+    Read a CSV written by write_csv, using pyarrow's multithreaded reader when available
+
+    Column types are applied while parsing, so string ids keep their leading zeros
+    (pandas' pyarrow engine infers integers first and only casts afterwards).
+    """
+    if pa is not None:
+        column_types = {col: pa.string() if col_type is str else pa.from_numpy_dtype(np.dtype(col_type))
+                        for col, col_type in (dtype or {}).items()}
+        convert_options = pacsv.ConvertOptions(column_types=column_types, include_columns=usecols or [],
+                                               strings_can_be_null=True)
+        return pacsv.read_csv(path, convert_options=convert_options).to_pandas()
+    return pd.read_csv(path, usecols=usecols, dtype=dtype)
+
+
+def write_parquet(df: pd.DataFrame, path: str) -> bool:
+    """Write a DataFrame to zstd-compressed Parquet; returns False if pyarrow is not installed"""
+    if pa is None:
+        return False
+    df.to_parquet(path, engine='pyarrow', compression='zstd', index=False)
+    return True
+
+
+def parse_deals(xml_file_path: str) -> Iterator:
+    """
+    Stream crdeal elements from a client XML file
+
+    Each element is fully built (including its deallife children) when yielded
+    and is cleared once the caller moves on, so memory stays flat regardless of
+    file size.
+
+    Args:
+        xml_file_path (str): Path to XML file
+
+    Yields:
+        crdeal elements in document order
+    """
+    if LET is not None:
+        with open(xml_file_path, 'rb') as f:
+            for _, crdeal in LET.iterparse(f, tag='crdeal', events=('end',),
+                                           huge_tree=False, remove_blank_text=True):
+                yield crdeal
+                # Free the processed deal and any siblings already handled
+                crdeal.clear(keep_tail=True)
+                while crdeal.getprevious() is not None:
+                    del crdeal.getparent()[0]
+    else:
+        for _, elem in ET.iterparse(xml_file_path, events=('end',)):
+            if elem.tag == 'crdeal':
+                yield elem
+                elem.clear()
+
 
 class XMLCreditDataProcessor:
     """Process XML credit data files and calculate client-level metrics"""
@@ -19,8 +176,11 @@ class XMLCreditDataProcessor:
         self.data_folder = data_folder
         self.clients_data = []
         self.results_df = None
+        self._metrics_df = None  # memoized calculate_client_metrics() result
+        self.deal_counts = np.zeros(0, dtype=np.int64)  # deals per client, aligned with clients_data
         
-    def parse_xml_file(self, xml_file_path: str) -> Dict:
+    @staticmethod
+    def parse_xml_file(xml_file_path: str) -> Dict:
         """
         Parse a single XML file (one client) and extract credit deal information
         
@@ -28,103 +188,52 @@ class XMLCreditDataProcessor:
             xml_file_path (str): Path to XML file
             
         Returns:
-            Dict: Parsed client data with deals and their history
+            Dict: Parsed client data with its deals (DEAL_FIELDS tuples) and the client's
+                  tabular rows (one tuple per deal history record, laid out as TABULAR_COLUMNS)
         """
+        client_file = os.path.basename(xml_file_path)
+        client_id = os.path.splitext(client_file)[0]
         client_data = {
-            'client_file': os.path.basename(xml_file_path),
-            'client_id': os.path.splitext(os.path.basename(xml_file_path))[0],
-            'deals': []
+            'client_file': client_file,
+            'client_id': client_id,
+            'deals': [],
+            'rows': []
         }
+        # Deals are streamed, so collect them locally and keep them only once the whole
+        # file has parsed - a malformed file contributes no deals, as with a full parse
+        deals = []
+        rows = []
         
         try:
-            tree = ET.parse(xml_file_path)
-            root = tree.getroot()
-            
             # Parse each credit deal (crdeal block)
-            for crdeal in root.findall('.//crdeal'):
-                deal_info = self._parse_deal_info(crdeal)
+            for crdeal in parse_deals(xml_file_path):
+                deal_info = tuple(map(crdeal.get, DEAL_FIELDS))
+                deals.append(deal_info)
+                
+                # Basic deal info, shared by every history row of the deal
+                # (numeric fields stay raw strings and are converted per column later)
+                base_record = (client_id, client_file) + deal_info
                 
-                # Parse deal history (deallife blocks)
-                deal_history = []
-                for deallife in crdeal.findall('.//deallife'):
-                    history_record = self._parse_deal_history(deallife)
-                    deal_history.append(history_record)
+                # Emit one tabular row per deal history record (deallife blocks)
+                has_history = False
+                for deallife in crdeal.iter('deallife'):
+                    rows.append(base_record + tuple(map(deallife.get, HISTORY_FIELDS)))
+                    has_history = True
                 
-                deal_info['history'] = deal_history
-                client_data['deals'].append(deal_info)
+                # Deals without history still get a base row so they count towards the loans total
+                if not has_history:
+                    rows.append(base_record + EMPTY_HISTORY)
+            
+            client_data['deals'] = deals
+            client_data['rows'] = rows
                 
-        except ET.ParseError as e:
+        except XMLParseError as e:
             print(f"Error parsing {xml_file_path}: {e}")
         except Exception as e:
             print(f"Unexpected error processing {xml_file_path}: {e}")
             
         return client_data
     
-    def _parse_deal_info(self, crdeal_element) -> Dict:
-        """Parse basic deal information from crdeal element"""
-        deal_info = {}
-        
-        # Key deal fields from attributes
-        attributes_to_extract = [
-            'dlref',      # Transaction ID
-            'lng',        # Part presentation
-            'dlcelcred',  # Transaction type
-            'dlvidobes',  # Type of collateral
-            'dlporpog',   # Redemption plan
-            'dlcurr',     # Transaction currency
-            'dlamt',      # Transaction amount (initial)
-            'dldonor',    # Information provider
-            'dldonornum', # Unique number of creditor
-            'primarydebt', # CHS type under main agreement
-            'dlrolesub',  # Subject's role
-            'dlamtobes',  # Collateral value in base currency
-            'bdate',      # Birth date (additional field)
-            'dlcelcredref', # Transaction type reference
-            'dlcurrref',  # Currency reference
-            'dlporpogref', # Redemption plan reference
-            'dlrolesubref', # Subject's role reference
-            'dlvidobesref', # Collateral type reference
-            'lngref'      # Language reference
-        ]
-        
-        for field in attributes_to_extract:
-            deal_info[field] = crdeal_element.get(field)
-                
-        return deal_info
-    
-    def _parse_deal_history(self, deallife_element) -> Dict:
-        """Parse deal history from deallife element"""
-        history_record = {}
-        
-        # Key history fields from attributes
-        attributes_to_extract = [
-            'dlref',        # Transaction ID
-            'dlmonth',      # Data period (month)
-            'dlyear',       # Data period (year)
-            'dlds',         # Transaction commencement date
-            'dldpf',        # Transaction closing date under contract
-            'dldff',        # Actual transaction end date
-            'dlflstat',     # Transaction status in current period
-            'dlflstatref',  # Transaction status reference
-            'dlamtlim',     # Current transaction limit
-            'dlamtpaym',    # Planned compulsory payment amount
-            'dlamtcur',     # Current debt amount
-            'dlamtexp',     # Current debt overdue amount
-            'dldayexp',     # Current number of days overdue
-            'dlflpay',      # Indication of payment made
-            'dlflpayref',   # Payment made reference
-            'dlflbrk',      # Indication of arrears present
-            'dlflbrkref',   # Arrears present reference
-            'dlfluse',      # Indication of credit tranche made
-            'dlfluseref',   # Credit tranche reference
-            'dldateclc'     # Calculation date
-        ]
-        
-        for field in attributes_to_extract:
-            history_record[field] = deallife_element.get(field)
-                
-        return history_record
-    
     def process_all_xml_files(self) -> List[Dict]:
         """Process all XML files in the data folder"""
         xml_files = glob.glob(os.path.join(self.data_folder, "*.xml"))
@@ -135,62 +244,103 @@ class XMLCreditDataProcessor:
         
         print(f"Found {len(xml_files)} XML files to process")
         
-        for xml_file in xml_files:
-            print(f"Processing: {xml_file}")
-            client_data = self.parse_xml_file(xml_file)
-            self.clients_data.append(client_data)
+        # New input invalidates previously derived tables
+        self.results_df = None
+        self._metrics_df = None
+        
+        # Files are independent - parse them on all cores when there is more than one
+        max_workers = min(len(xml_files), os.cpu_count() or 1)
+        if max_workers > 1:
+            chunksize = max(1, len(xml_files) // (4 * max_workers))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                parsed = executor.map(XMLCreditDataProcessor.parse_xml_file, xml_files, chunksize=chunksize)
+                for xml_file, client_data in zip(xml_files, parsed):
+                    print(f"Processed: {xml_file}")
+                    self.clients_data.append(client_data)
+        else:
+            for xml_file in xml_files:
+                print(f"Processing: {xml_file}")
+                self.clients_data.append(self.parse_xml_file(xml_file))
+        
+        self._update_deal_counts()
             
         return self.clients_data
     
+    def _update_deal_counts(self):
+        """Refresh the per-client deal count array from clients_data"""
+        self.deal_counts = np.fromiter((len(client['deals']) for client in self.clients_data),
+                                       dtype=np.int64, count=len(self.clients_data))
+    
+    def save_cache(self, cache_file: str = PROCESSOR_CACHE_FILE):
+        """
+        Pickle parsed clients_data together with the signature of the XML inputs
+
+        Only client ids and deals are cached - the tabular rows are already exported
+        to the detailed data files, so they are left out to keep the cache small.
+        """
+        clients = [{key: value for key, value in client.items() if key != 'rows'}
+                   for client in self.clients_data]
+        with open(cache_file, 'wb') as f:
+            pickle.dump((CACHE_FORMAT, xml_folder_signature(self.data_folder), clients), f)
+    
+    def load_cache(self, cache_file: str = PROCESSOR_CACHE_FILE) -> bool:
+        """
+        Reuse clients_data from a cache written by save_cache
+        
+        The cached clients carry their deals but no tabular rows, so the XML files
+        must be processed again before calling create_tabular_format.
+        
+        Returns:
+            bool: True if the cache matched the current XML inputs and was loaded
+        """
+        if not os.path.exists(cache_file):
+            return False
+        
+        try:
+            with open(cache_file, 'rb') as f:
+                cache_format, signature, clients_data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            print(f"Ignoring unreadable cache {cache_file}: {e}")
+            return False
+        
+        if cache_format != CACHE_FORMAT or signature != xml_folder_signature(self.data_folder):
+            return False
+        
+        self.clients_data = clients_data
+        self.results_df = None
+        self._metrics_df = None
+        self._update_deal_counts()
+        return True
+    
     def create_tabular_format(self) -> pd.DataFrame:
         """Convert parsed XML data to tabular format"""
-        tabular_data = []
+        if self.results_df is not None:
+            return self.results_df
         
-        for client in self.clients_data:
-            client_id = client['client_id']
-            
-            for deal in client['deals']:
-                deal_id = deal.get('dlref', 'Unknown')
-                
-                # Basic deal info
-                base_record = {
-                    'client_id': client_id,
-                    'client_file': client['client_file'],
-                    'deal_id': deal_id,
-                    'transaction_amount': self._safe_float(deal.get('dlamt')),
-                    'transaction_type': deal.get('dlcelcred'),
-                    'currency': deal.get('dlcurr'),
-                    'collateral_type': deal.get('dlvidobes'),
-                    'subject_role': deal.get('dlrolesub'),
-                    'collateral_value': self._safe_float(deal.get('dlamtobes'))
-                }
-                
-                # Add history records
-                for history in deal.get('history', []):
-                    record = base_record.copy()
-                    record.update({
-                        'period_month': self._safe_int(history.get('dlmonth')),
-                        'period_year': self._safe_int(history.get('dlyear')),
-                        'start_date': history.get('dlds'),
-                        'planned_end_date': history.get('dldpf'),
-                        'actual_end_date': history.get('dldff'),
-                        'deal_status': self._safe_int(history.get('dlflstat')),
-                        'current_limit': self._safe_float(history.get('dlamtlim')),
-                        'planned_payment': self._safe_float(history.get('dlamtpaym')),
-                        'current_debt': self._safe_float(history.get('dlamtcur')),
-                        'overdue_debt': self._safe_float(history.get('dlamtexp')),
-                        'days_overdue': self._safe_int(history.get('dldayexp')),
-                        'payment_made': self._safe_int(history.get('dlflpay')),
-                        'arrears_present': self._safe_int(history.get('dlflbrk')),
-                        'calculation_date': history.get('dldateclc')
-                    })
-                    tabular_data.append(record)
-        
-        df = pd.DataFrame(tabular_data)
-        
-        # Remove duplicates based on key fields
-        df = df.drop_duplicates(subset=['client_id', 'deal_id', 'period_month', 'period_year'], keep='last')
+        # Rows were already emitted by the parser - just stitch clients together
+        tabular_data = list(chain.from_iterable(client['rows'] for client in self.clients_data))
+        
+        # Transpose into one sequence per column so every column is typed before the
+        # frame exists and the BlockManager receives ready-made arrays
+        columns = dict(zip(TABULAR_COLUMNS, zip(*tabular_data))) if tabular_data else \
+            {col: np.empty(0, dtype=object) for col in TABULAR_COLUMNS}
+        
+        # Convert numeric columns in one pass each; empty or invalid values become NaN
+        for col in FLOAT_COLUMNS:
+            columns[col] = pd.to_numeric(columns[col], errors='coerce').astype('float64')
+        for col in INT_COLUMNS:
+            columns[col] = pd.to_numeric(columns[col], errors='coerce')
+        for col in CATEGORICAL_COLUMNS:
+            columns[col] = pd.Categorical(columns[col])
         
+        df = pd.DataFrame(columns, columns=TABULAR_COLUMNS, copy=False)
+        
+        # Remove duplicates based on key fields, keeping the last record per key in file order
+        # (grouping on the narrow key set avoids hashing the wide object columns)
+        df = df.groupby(['client_id', 'deal_id', 'period_year', 'period_month'],
+                        sort=False, observed=True, dropna=False).tail(1)
+        
+        self.results_df = df
         return df
     
     def _safe_float(self, value):
@@ -211,8 +361,25 @@ class XMLCreditDataProcessor:
         except (ValueError, TypeError):
             return None
     
-    def calculate_client_metrics(self) -> pd.DataFrame:
-        """Calculate required metrics for each client"""
+    def _compute_deal_summary(self) -> pd.DataFrame:
+        """Latest state of each deal - one row per (client_id, deal_id)"""
+        return self.results_df.groupby(['client_id', 'deal_id'], observed=True).agg({
+            'deal_status': 'last',  # Take last status for each deal
+            'actual_end_date': 'last',
+            'overdue_debt': 'last',
+            'days_overdue': 'last'
+        }).reset_index()
+    
+    def calculate_client_metrics(self, deal_summary: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Calculate required metrics for each client
+        
+        Args:
+            deal_summary (pd.DataFrame): Precomputed result of _compute_deal_summary(), if available
+        """
+        if self._metrics_df is not None:
+            return self._metrics_df
+        
         if self.results_df is None:
             self.results_df = self.create_tabular_format()
         
@@ -221,64 +388,70 @@ class XMLCreditDataProcessor:
             return pd.DataFrame()
         
         # Group by client and deal to get unique deals per client
-        deal_summary = self.results_df.groupby(['client_id', 'deal_id']).agg({
-            'deal_status': 'last',  # Take last status for each deal
-            'actual_end_date': 'last',
-            'overdue_debt': 'last',
-            'days_overdue': 'last'
-        }).reset_index()
+        if deal_summary is None:
+            deal_summary = self._compute_deal_summary()
         
-        # Calculate metrics for each client
-        client_metrics = []
+        # 1. Total count of loans = number of deal_summary rows per client
         
-        for client_id in deal_summary['client_id'].unique():
-            client_deals = deal_summary[deal_summary['client_id'] == client_id]
-            
-            # 1. Total count of loans
-            total_loans = len(client_deals)
-            
-            # 2. Ratio of closed loans count over total loans count
-            # A loan is considered closed based on deal_status:
-            # Status 1 = Open, Status 2+ = Closed (Close, Sold, Restructured, etc.)
-            # Alternative: also check actual_end_date as secondary indicator
-            closed_loans = client_deals[
-                (client_deals['deal_status'] > 1) |  # Status > 1 means closed
-                ((client_deals['actual_end_date'].notna()) & 
-                 (client_deals['actual_end_date'] != '') & 
-                 (client_deals['actual_end_date'] != 'nan'))
-            ].shape[0]
-            closed_ratio = closed_loans / total_loans if total_loans > 0 else 0
-            
-            # 3. Sum of currently expired deals amount over 30+ days
-            expired_30_plus = client_deals[
-                (client_deals['days_overdue'] > 30) & 
-                (client_deals['overdue_debt'].notna()) &
-                (client_deals['overdue_debt'] > 0)
-            ]['overdue_debt'].sum()
-            
-            client_metrics.append({
-                'client_id': client_id,
-                'total_loans_count': total_loans,
-                'closed_loans_count': closed_loans,
-                'closed_loans_ratio': round(closed_ratio, 4),
-                'expired_30_plus_amount': round(expired_30_plus, 2) if pd.notna(expired_30_plus) else 0
-            })
-        
-        return pd.DataFrame(client_metrics)
+        # 2. Ratio of closed loans count over total loans count
+        # A loan is considered closed based on deal_status:
+        # Status 1 = Open, Status 2+ = Closed (Close, Sold, Restructured, etc.)
+        # Alternative: also check actual_end_date as secondary indicator
+        closed_mask = (
+            (deal_summary['deal_status'] > 1) |  # Status > 1 means closed
+            ((deal_summary['actual_end_date'].notna()) & 
+             (deal_summary['actual_end_date'] != '') & 
+             (deal_summary['actual_end_date'] != 'nan'))
+        )
+        
+        # 3. Sum of currently expired deals amount over 30+ days
+        expired_mask = (
+            (deal_summary['days_overdue'] > 30) & 
+            (deal_summary['overdue_debt'].notna()) &
+            (deal_summary['overdue_debt'] > 0)
+        )
+        
+        # Aggregate all clients in a single groupby
+        client_metrics = deal_summary.assign(
+            closed=closed_mask,
+            expired_amount=deal_summary['overdue_debt'].where(expired_mask, 0)
+        ).groupby('client_id', observed=True).agg(
+            total_loans_count=('deal_id', 'size'),
+            closed_loans_count=('closed', 'sum'),
+            expired_30_plus_amount=('expired_amount', 'sum')
+        ).reset_index()
+        
+        client_metrics['closed_loans_ratio'] = (
+            client_metrics['closed_loans_count'] / client_metrics['total_loans_count']
+        ).round(4)
+        client_metrics['expired_30_plus_amount'] = client_metrics['expired_30_plus_amount'].round(2)
+        
+        self._metrics_df = client_metrics[['client_id', 'total_loans_count', 'closed_loans_count',
+                                           'closed_loans_ratio', 'expired_30_plus_amount']]
+        return self._metrics_df
     
-    def export_results(self, output_file: str = "client_metrics_results.csv"):
-        """Export calculated metrics to CSV file"""
+    def export_results(self, output_file: str = "client_metrics_results.csv", detailed_csv: bool = True):
+        """
+        Export calculated metrics to CSV file
+        
+        Detailed tabular data is saved as Parquet when pyarrow is available and,
+        unless detailed_csv is False, also as CSV for downstream consumers.
+        """
         metrics_df = self.calculate_client_metrics()
         
         if not metrics_df.empty:
-            metrics_df.to_csv(output_file, index=False)
+            write_csv(metrics_df, output_file)
             print(f"Results exported to {output_file}")
             
             # Also save detailed tabular data
-            detailed_file = "detailed_credit_data.csv"
             if self.results_df is not None and not self.results_df.empty:
-                self.results_df.to_csv(detailed_file, index=False)
-                print(f"Detailed data exported to {detailed_file}")
+                if detailed_csv or pa is None:
+                    write_csv(self.results_df, "detailed_credit_data.csv")
+                    print("Detailed data exported to detailed_credit_data.csv")
+                
+                # Written last so readers see it as at least as fresh as the CSV
+                if write_parquet(self.results_df, "detailed_credit_data.parquet"):
+                    print("Detailed data exported to detailed_credit_data.parquet")
             
             return metrics_df
         else:
@@ -294,52 +467,56 @@ class XMLCreditDataProcessor:
             validation_results['issues'].append("No tabular data available for validation")
             return validation_results
         
-        metrics_df = self.calculate_client_metrics()
+        # Deal summary is computed once and shared with the metrics calculation
+        deal_summary = self._compute_deal_summary()
+        metrics_df = self.calculate_client_metrics(deal_summary)
         if metrics_df.empty:
             validation_results['status'] = 'FAILED'
             validation_results['issues'].append("No metrics calculated for validation")
             return validation_results
         
-        # Validate each client's metrics
-        for _, row in metrics_df.iterrows():
-            client_id = row['client_id']
-            client_data = self.results_df[self.results_df['client_id'] == client_id]
+        client_index = pd.Index(metrics_df['client_id'])
+        
+        # 1. Check total loans count against distinct deals in the raw records
+        unique_deals = self.results_df.groupby('client_id', observed=True)['deal_id'].nunique().reindex(client_index, fill_value=0)
+        count_bad = unique_deals.to_numpy() != metrics_df['total_loans_count'].to_numpy()
+        
+        # 2. Check closed loans ratio is within valid range
+        ratio_bad = ~metrics_df['closed_loans_ratio'].between(0, 1).to_numpy()
+        
+        # 3. Check expired amount is not negative
+        negative_bad = (metrics_df['expired_30_plus_amount'] < 0).to_numpy()
+        
+        # 4. Check data consistency - expired debt from the latest state of each deal
+        manual_expired = deal_summary[
+            (deal_summary['days_overdue'] > 30) & 
+            (deal_summary['overdue_debt'].notna())
+        ].groupby('client_id', observed=True)['overdue_debt'].sum().reindex(client_index, fill_value=0)
+        expired_bad = np.abs(manual_expired.to_numpy() - metrics_df['expired_30_plus_amount'].to_numpy()) > 0.01
+        
+        # Report only the clients that failed at least one check
+        flagged = np.flatnonzero(count_bad | ratio_bad | negative_bad | expired_bad)
+        for i, row in zip(flagged, metrics_df.iloc[flagged].itertuples(index=False)):
+            client_id = row.client_id
             
-            # 1. Check total loans count
-            unique_deals = client_data['deal_id'].nunique()
-            if unique_deals != row['total_loans_count']:
+            if count_bad[i]:
                 validation_results['issues'].append(
-                    f"Client {client_id}: Deal count mismatch - expected {unique_deals}, got {row['total_loans_count']}"
+                    f"Client {client_id}: Deal count mismatch - expected {unique_deals.iloc[i]}, got {row.total_loans_count}"
                 )
             
-            # 2. Check closed loans ratio is within valid range
-            if not 0 <= row['closed_loans_ratio'] <= 1:
+            if ratio_bad[i]:
                 validation_results['issues'].append(
-                    f"Client {client_id}: Invalid closed ratio {row['closed_loans_ratio']} (should be 0-1)"
+                    f"Client {client_id}: Invalid closed ratio {row.closed_loans_ratio} (should be 0-1)"
                 )
             
-            # 3. Check expired amount is not negative
-            if row['expired_30_plus_amount'] < 0:
+            if negative_bad[i]:
                 validation_results['issues'].append(
-                    f"Client {client_id}: Negative expired amount {row['expired_30_plus_amount']}"
+                    f"Client {client_id}: Negative expired amount {row.expired_30_plus_amount}"
                 )
             
-            # 4. Check data consistency
-            latest_status = client_data.groupby('deal_id').agg({
-                'actual_end_date': 'last',
-                'overdue_debt': 'last',
-                'days_overdue': 'last'
-            }).reset_index()
-            
-            # Validate expired debt calculation
-            manual_expired = latest_status[
-                (latest_status['days_overdue'] > 30) & 
-                (latest_status['overdue_debt'].notna())
-            ]['overdue_debt'].sum()
-            
-            if abs(manual_expired - row['expired_30_plus_amount']) > 0.01:
+            if expired_bad[i]:
                 validation_results['issues'].append(
-                    f"Client {client_id}: Expired amount calculation error - expected {manual_expired:.2f}, got {row['expired_30_plus_amount']}"
+                    f"Client {client_id}: Expired amount calculation error - expected {manual_expired.iloc[i]:.2f}, got {row.expired_30_plus_amount}"
                 )
         
         if validation_results['issues']:
@@ -356,7 +533,7 @@ class XMLCreditDataProcessor:
         print(f"\n=== DATA PROCESSING SUMMARY ===")
         print(f"Total clients processed: {len(self.clients_data)}")
         
-        total_deals = sum(len(client['deals']) for client in self.clients_data)
+        total_deals = int(self.deal_counts.sum())
         print(f"Total deals processed: {total_deals}")
         
         if self.results_df is not None: